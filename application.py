@@ -1,12 +1,302 @@
-import json
+import os
+import queue
 import threading
 
+import orjson
 from flask import Flask, request
+from flask.json.provider import DefaultJSONProvider
+
+from src.blockchain import Block, get_current_blockchain
+from src.utilities import (
+    BLOCKCHAIN_CACHE_TXT_FILE,
+    MINIMUM_NUMBER_OF_TRANSACTIONS_PER_BLOCK,
+    TEST_BLOCKCHAIN_CACHE_TXT_FILE,
+    BlockchainCacheWriter,
+    check_data_is_valid_transaction,
+)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that parses request bodies with orjson."""
+
+    def loads(self, s, **kwargs):
+        """
+        Deserializes a JSON string or bytes, e.g. a request body.
+
+        :param s: JSON formatted string or bytes
+        :return: Deserialized object
+        """
+
+        # orjson.JSONDecodeError is a ValueError, so Flask still answers malformed bodies with 400 Bad Request
+        return orjson.loads(s)
 
-from src.blockchain import get_current_blockchain
-from src.utilities import BLOCKCHAIN_CACHE_TXT_FILE, TEST_BLOCKCHAIN_CACHE_TXT_FILE, check_data_is_valid_transaction
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Indented output with a trailing newline, matching what curl users expect to read
+JSON_OUTPUT_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE
+
+# Serializes every use of the in-memory blockchains and their cache files between request handlers and the miner.
+# Reentrant so helpers can take it themselves while their callers already hold it.
+blockchain_lock = threading.RLock()
+
+# Cache file paths whose blockchain has enough unconfirmed transactions to be mined
+mining_queue = queue.Queue()
+
+
+class _CachedBlockchain:
+    """In-memory blockchain for one cache file, along with what is known about that file."""
+
+    def __init__(self, blockchain, signature):
+        """
+        Constructs the _CachedBlockchain instance.
+
+        :param blockchain: Blockchain object parsed from the cache file
+        :param signature: Cache file signature when it was parsed; None if the file didn't exist
+        """
+
+        self.blockchain = blockchain
+        self.signature = signature
+        # A missing or empty cache file has to be started with a snapshot before records can be appended to it
+        self.has_log = signature is not None and signature[1] > 0
+        # Writes queued on the cache writer that haven't reached the file yet. The blockchain is never reloaded while
+        # any are pending, so they can't land in a file that has been parsed again.
+        self.pending_writes = 0
+        # Whether any queued write failed, leaving the in-memory blockchain ahead of its cache file
+        self.write_failed = False
+        # Rendered /chain response, dropped whenever the blockchain changes
+        self.chain_response = None
+
+
+# Blockchains kept in memory between requests, keyed by cache file path
+_blockchains = {}
+
+
+def _get_cache_file_signature(blockchain_cache_filepath):
+    """
+    Gets the modification time and size of a cache file, which together change whenever the file is written.
+
+    :param blockchain_cache_filepath: Path to the blockchain .txt file
+    :return: Tuple of the modification time in nanoseconds and the size in bytes; None if the file doesn't exist
+    """
+
+    try:
+        file_stat = os.stat(blockchain_cache_filepath)
+
+    except FileNotFoundError:
+        return None
+
+    return file_stat.st_mtime_ns, file_stat.st_size
+
+
+def _is_indented_snapshot(blockchain_cache_filepath):
+    """
+    Checks whether a cache file holds a single indented snapshot, as written before the cache became an append-only
+    log. Log records are one line each, so a file whose first line is only an opening brace is not a log.
+
+    :param blockchain_cache_filepath: Path to the blockchain .txt file
+    :return: True if the file holds an indented snapshot; False otherwise
+    """
+
+    try:
+        with open(blockchain_cache_filepath, "rb") as file:
+            return file.read(2) == b"{\n"
+
+    except FileNotFoundError:
+        return False
+
+
+def _trim_torn_record(blockchain_cache_filepath):
+    """
+    Cuts a record that was only partly written, e.g. because the process was killed mid-write, off the end of a cache
+    file. The parser skips it, but the next record appended would continue the same line, leaving a line in the
+    middle of the log that can never be parsed.
+
+    :param blockchain_cache_filepath: Path to the blockchain .txt file
+    :return: True if the file was trimmed; False otherwise
+    """
+
+    try:
+        with open(blockchain_cache_filepath, "rb+") as file:
+            contents = file.read()
+
+            if not contents or contents.endswith(b"\n"):
+                return False
+
+            # Everything after the last newline belongs to the torn record, which is the whole file if it has none
+            file.truncate(contents.rfind(b"\n") + 1)
+
+    except FileNotFoundError:
+        return False
+
+    return True
+
+
+def _rewrite_blockchain_cache(blockchain_cache_filepath, blockchain):
+    """
+    Replaces a cache file with a one-line snapshot of the blockchain that records can be appended to. The snapshot is
+    written to a temporary file that is then renamed over the cache, so the cache is never left half written.
+
+    :param blockchain_cache_filepath: Path to the blockchain .txt file
+    :param blockchain: Blockchain object to write
+    :return: None
+    """
+
+    temporary_filepath = blockchain_cache_filepath + ".tmp"
+
+    with open(temporary_filepath, "wb") as file:
+        file.write(orjson.dumps(blockchain.__dict__(), option=orjson.OPT_APPEND_NEWLINE))
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temporary_filepath, blockchain_cache_filepath)
+
+
+def _on_cache_written(blockchain_cache_filepath, cached, writes, error):
+    """
+    Called by the cache writer once queued records have been written. When the file has caught up with the in-memory
+    blockchain, its new signature is recorded so the write isn't mistaken for an outside change. If a write failed,
+    the blockchain is dropped once nothing else is queued for it, so the file is parsed again next time.
+
+    :param blockchain_cache_filepath: Path to the blockchain .txt file
+    :param cached: _CachedBlockchain object the records were queued for
+    :param writes: Number of records written
+    :param error: OSError raised while writing; None on success
+    :return: None
+    """
+
+    with blockchain_lock:
+        # The writes are counted against the entry that queued them, even if it has been replaced since
+        cached.pending_writes -= writes
+
+        if error is not None:
+            app.logger.error("Writing to %s failed: %s", blockchain_cache_filepath, error)
+            cached.write_failed = True
+
+        if cached.pending_writes or _blockchains.get(blockchain_cache_filepath) is not cached:
+            return
+
+        if cached.write_failed:
+            # The in-memory blockchain is ahead of its cache file, and no more queued writes can land after a reload
+            del _blockchains[blockchain_cache_filepath]
+
+        else:
+            cached.signature = _get_cache_file_signature(blockchain_cache_filepath)
+
+
+# Appends cache log records in batches on a background thread so requests never wait on the disk
+cache_writer = BlockchainCacheWriter(on_write=_on_cache_written)
+
+
+def _load_blockchain(blockchain_cache_filepath):
+    """
+    Gets the in-memory blockchain for a cache file. The file is only parsed again when its signature no longer matches
+    what this process last read or wrote, e.g. because the cache was cleared, so most requests cost a single stat.
+    While writes to the file are still queued, the in-memory blockchain is ahead of it and is used as is.
+
+    :param blockchain_cache_filepath: Path to the blockchain .txt file
+    :return: _CachedBlockchain object
+    """
+
+    with blockchain_lock:
+        cached = _blockchains.get(blockchain_cache_filepath)
+
+        if cached is not None and cached.pending_writes:
+            return cached
+
+        signature = _get_cache_file_signature(blockchain_cache_filepath)
+
+        if cached is None or cached.signature != signature:
+            blockchain = get_current_blockchain(blockchain_cache_filepath)
+
+            # Appending a record to an indented snapshot would leave a file that can't be parsed, so convert it first
+            if _is_indented_snapshot(blockchain_cache_filepath):
+                _rewrite_blockchain_cache(blockchain_cache_filepath, blockchain)
+                signature = _get_cache_file_signature(blockchain_cache_filepath)
+
+            # Likewise a record appended after a torn one would run into it, so the torn record is cut off first
+            elif _trim_torn_record(blockchain_cache_filepath):
+                signature = _get_cache_file_signature(blockchain_cache_filepath)
+
+            cached = _CachedBlockchain(blockchain, signature)
+            _blockchains[blockchain_cache_filepath] = cached
+
+        return cached
+
+
+def _append_to_blockchain_cache(cached, blockchain_cache_filepath, *records):
+    """
+    Queues records to be appended to the blockchain's append-only cache log as a single write. A missing or empty log
+    is started with a snapshot of the whole blockchain instead, which already includes whatever the records describe.
+
+    :param cached: _CachedBlockchain object the records were applied to
+    :param blockchain_cache_filepath: Path to the blockchain .txt file
+    :param records: Dictionaries each holding either a "transaction" or a "block"
+    :return: None
+    """
+
+    with blockchain_lock:
+        cached.chain_response = None
+
+        if not cached.has_log:
+            records = (cached.blockchain.__dict__(),)
+            cached.has_log = True
+
+        # Encoded now, since the blockchain may change again before the writer gets to it
+        cached.pending_writes += 1
+        cache_writer.enqueue(
+            blockchain_cache_filepath,
+            b"".join(orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE) for record in records),
+            cached,
+        )
+
+
+def _mine_queued_blockchains():
+    """
+    Mines queued blockchains in the background so /send never waits on the proof-of-work. The lock is only held to
+    build the new block and to add it, so requests are served while the proof-of-work runs.
+    """
+
+    while True:
+        blockchain_cache_filepath = mining_queue.get()
+
+        try:
+            with blockchain_lock:
+                cached = _load_blockchain(blockchain_cache_filepath)
+                blockchain = cached.blockchain
+
+                if len(blockchain.unconfirmed_transactions) < MINIMUM_NUMBER_OF_TRANSACTIONS_PER_BLOCK:
+                    continue
+
+                last_block = blockchain.last_block
+                new_block = Block(
+                    index=last_block.index + 1,
+                    transactions=list(blockchain.unconfirmed_transactions),
+                    previous_hash=last_block.compute_hash(),
+                )
+
+            proof = blockchain.proof_of_work(new_block)
+
+            with blockchain_lock:
+                # The cache was reloaded or another block was added while mining, so the new block no longer fits
+                if _blockchains.get(blockchain_cache_filepath) is not cached or blockchain.last_block is not last_block:
+                    mining_queue.put(blockchain_cache_filepath)
+                    continue
+
+                blockchain.add_block(new_block, proof)
+                # Transactions sent while mining weren't included in the block, so they stay unconfirmed
+                blockchain.unconfirmed_transactions = blockchain.unconfirmed_transactions[len(new_block.transactions) :]
+                _append_to_blockchain_cache(cached, blockchain_cache_filepath, {"block": new_block.__dict__})
+
+        except Exception:
+            app.logger.exception("Mining failed for %s", blockchain_cache_filepath)
+
+        finally:
+            mining_queue.task_done()
+
+
+threading.Thread(target=_mine_queued_blockchains, daemon=True).start()
 
 
 @app.route("/chain", methods=["GET"])
@@ -25,9 +315,13 @@ def get_chain():
         blockchain_cache_filepath = (
             BLOCKCHAIN_CACHE_TXT_FILE if not app.config["TESTING"] else TEST_BLOCKCHAIN_CACHE_TXT_FILE
         )
-        blockchain = get_current_blockchain(blockchain_cache_filepath)
+        with blockchain_lock:
+            cached = _load_blockchain(blockchain_cache_filepath)
+
+            if cached.chain_response is None:
+                cached.chain_response = orjson.dumps(cached.blockchain.__dict__(), option=JSON_OUTPUT_OPTIONS)
 
-        return json.dumps(blockchain.__dict__(), indent=4) + "\n", 200
+            return cached.chain_response, 200
 
     except:
         return "FAILURE", 400
@@ -36,8 +330,8 @@ def get_chain():
 @app.route("/send", methods=["POST"])
 def add_transaction_to_blockchain():
     """
-    Adds transaction into unconfirmed transactions list. If the unconfirmed transactions list exceeds the minimum
-    number of transactions needed for a block, attempt to mine the block.
+    Adds transaction into unconfirmed transactions list. If the unconfirmed transactions list reaches the minimum
+    number of transactions needed for a block, queue the blockchain to be mined in the background.
 
     Send a transaction by using command line:
 
@@ -50,7 +344,6 @@ def add_transaction_to_blockchain():
         blockchain_cache_filepath = (
             BLOCKCHAIN_CACHE_TXT_FILE if not app.config["TESTING"] else TEST_BLOCKCHAIN_CACHE_TXT_FILE
         )
-        blockchain = get_current_blockchain(blockchain_cache_filepath)
         data = request.get_json()
 
         if not check_data_is_valid_transaction(data):
@@ -59,20 +352,77 @@ def add_transaction_to_blockchain():
                 '{"sender_id": str, "receiver_id": str, "timestamp": float, "amount": float}\n'
             ), 400
 
-        transaction_details = blockchain.add_new_transaction(
-            data["sender_id"], data["receiver_id"], data["timestamp"], data["amount"]
+        with blockchain_lock:
+            cached = _load_blockchain(blockchain_cache_filepath)
+            transaction_details = cached.blockchain.add_new_transaction(
+                data["sender_id"], data["receiver_id"], data["timestamp"], data["amount"]
+            )
+            _append_to_blockchain_cache(cached, blockchain_cache_filepath, {"transaction": transaction_details.data})
+
+            if len(cached.blockchain.unconfirmed_transactions) >= MINIMUM_NUMBER_OF_TRANSACTIONS_PER_BLOCK:
+                mining_queue.put(blockchain_cache_filepath)
+
+        return orjson.dumps(transaction_details.data, option=JSON_OUTPUT_OPTIONS), 200
+
+    except:
+        return "FAILURE", 400
+
+
+@app.route("/send_batch", methods=["POST"])
+def add_transactions_to_blockchain():
+    """
+    Adds a list of transactions into the unconfirmed transactions list at once, with a single cache write. Nothing is
+    added unless every transaction is valid. If the unconfirmed transactions list reaches the minimum number of
+    transactions needed for a block, queue the blockchain to be mined in the background.
+
+    Send transactions by using command line:
+
+        curl http://127.0.0.1:5000/send_batch -H 'Content-Type: application/json' -d '[{"sender_id": "", "receiver_id": "", "timestamp": 0.0, "amount": 0.0}]'
+
+    :return: JSON formatted list of transaction details or error message
+    """
+
+    try:
+        blockchain_cache_filepath = (
+            BLOCKCHAIN_CACHE_TXT_FILE if not app.config["TESTING"] else TEST_BLOCKCHAIN_CACHE_TXT_FILE
         )
+        data = request.get_json()
+
+        if not isinstance(data, list) or not all(map(check_data_is_valid_transaction, data)):
+            return (
+                "Invalid Transaction! Transactions must be a list of:\n "
+                '{"sender_id": str, "receiver_id": str, "timestamp": float, "amount": float}\n'
+            ), 400
+
+        with blockchain_lock:
+            cached = _load_blockchain(blockchain_cache_filepath)
+            transactions_data = []
+
+            for transaction in data:
+                transaction_details = cached.blockchain.add_new_transaction(
+                    transaction["sender_id"],
+                    transaction["receiver_id"],
+                    transaction["timestamp"],
+                    transaction["amount"],
+                )
+                transactions_data.append(transaction_details.data)
 
-        blockchain.mine()
+            if transactions_data:
+                _append_to_blockchain_cache(
+                    cached,
+                    blockchain_cache_filepath,
+                    *({"transaction": transaction_data} for transaction_data in transactions_data),
+                )
 
-        with open(blockchain_cache_filepath, "w") as file:
-            file.write(json.dumps(blockchain.__dict__(), indent=4) + "\n")
+            if len(cached.blockchain.unconfirmed_transactions) >= MINIMUM_NUMBER_OF_TRANSACTIONS_PER_BLOCK:
+                mining_queue.put(blockchain_cache_filepath)
 
-        return json.dumps(transaction_details.data, indent=4) + "\n", 200
+        return orjson.dumps(transactions_data, option=JSON_OUTPUT_OPTIONS), 200
 
     except:
         return "FAILURE", 400
 
 
 if __name__ == "__main__":
-    app.run(debug=True, port=5000)
+    # Development server only; see README.md for serving with gunicorn
+    app.run(port=5000)
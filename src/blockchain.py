@@ -1,52 +1,84 @@
+import functools
 import json
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from hashlib import sha256
 
-from src.utilities import BLOCKCHAIN_CACHE_TXT_FILE, DEFAULT_DIFFICULTY, MINIMUM_NUMBER_OF_TRANSACTIONS_PER_BLOCK
+import orjson
 
+from src.utilities import (
+    BLOCKCHAIN_CACHE_TXT_FILE,
+    DEFAULT_DIFFICULTY,
+    MINIMUM_NUMBER_OF_TRANSACTIONS_PER_BLOCK,
+    NONCES_PER_PROOF_OF_WORK_TASK,
+)
 
+
+@dataclass(frozen=True, slots=True)
 class Transaction:
-    def __init__(self, sender_id, receiver_id, timestamp, amount):
-        """
-        Constructs the Transaction instance.
+    sender_id: str
+    receiver_id: str
+    timestamp: float
+    amount: float
+    # Built once in __post_init__; the transaction is frozen, so it can never go stale
+    data: dict = field(init=False, repr=False, compare=False)
 
-        :param sender_id: Sender ID
-        :param receiver_id: Receiver ID
-        :param timestamp: Timestamp of the transaction
-        :param amount: Amount transacted
-        """
+    def __post_init__(self):
+        """Validates the Transaction instance's fields and builds its data dictionary."""
 
-        if not isinstance(sender_id, str):
+        if not isinstance(self.sender_id, str):
             raise TypeError("ERROR: param sender_id must be of type str")
 
-        if not isinstance(receiver_id, str):
+        if not isinstance(self.receiver_id, str):
             raise TypeError("ERROR: param receiver_id must be of type str")
 
-        if not isinstance(timestamp, float):
+        if not isinstance(self.timestamp, float):
             raise TypeError("ERROR: param timestamp must be of type float")
 
-        if not isinstance(amount, (int, float)):
+        if not isinstance(self.amount, (int, float)):
             raise TypeError("ERROR: param amount must be of type int or float")
 
-        self.sender_id = sender_id
-        self.receiver_id = receiver_id
-        self.timestamp = timestamp
-        self.amount = amount
+        object.__setattr__(
+            self,
+            "data",
+            {
+                "sender_id": self.sender_id,
+                "receiver_id": self.receiver_id,
+                "timestamp": self.timestamp,
+                "amount": self.amount,
+            },
+        )
 
-    @property
-    def data(self):
-        """Returns transaction data as a dictionary."""
+    @classmethod
+    def _from_trusted(cls, sender_id, receiver_id, timestamp, amount):
+        """
+        Constructs a Transaction from fields whose types have already been checked, skipping the checks in
+        __post_init__.
 
-        return {
-            "sender_id": self.sender_id,
-            "receiver_id": self.receiver_id,
-            "timestamp": self.timestamp,
-            "amount": self.amount,
-        }
+        :param sender_id: Sender ID
+        :param receiver_id: Receiver ID
+        :param timestamp: Timestamp of the transaction
+        :param amount: Amount transacted
+        :return: Transaction object
+        """
+
+        transaction = object.__new__(cls)
+        data = {"sender_id": sender_id, "receiver_id": receiver_id, "timestamp": timestamp, "amount": amount}
+
+        for name, value in data.items():
+            object.__setattr__(transaction, name, value)
+
+        object.__setattr__(transaction, "data", data)
+
+        return transaction
 
 
 class Block:
+    # Cached serialization and hash live in slots rather than __dict__ so they are never part of the block's data
+    __slots__ = ("__dict__", "_serialized", "_midstate", "_hash")
+
     def __init__(self, index, transactions, previous_hash, timestamp=time.time(), nonce=0):
         """
         Constructs the Block instance.
@@ -73,12 +105,59 @@ class Block:
         if not isinstance(nonce, int):
             raise TypeError("ERROR: param nonce must be of type int")
 
+        self._serialized = None
+        self._midstate = None
+        self._hash = None
         self.index = index
         self.transactions = transactions
         self.timestamp = timestamp
         self.previous_hash = previous_hash
         self.nonce = nonce
 
+    def __setattr__(self, name, value):
+        """
+        Drops the cached hash whenever a hashed field is reassigned, and the cached serialization unless only the
+        nonce changed.
+        """
+
+        if name == "nonce":
+            object.__setattr__(self, "_hash", None)
+
+        elif name in ("index", "transactions", "timestamp", "previous_hash"):
+            object.__setattr__(self, "_serialized", None)
+            object.__setattr__(self, "_hash", None)
+
+        object.__setattr__(self, name, value)
+
+    @classmethod
+    def _from_trusted(cls, index, transactions, previous_hash, timestamp, nonce):
+        """
+        Constructs a Block from fields whose types have already been checked or converted, skipping the checks in
+        __init__.
+
+        :param index: The index of the block
+        :param transactions: List of transactions in the block
+        :param previous_hash: The hash of the previous block
+        :param timestamp: Timestamp of the block's creation
+        :param nonce: Number used to change the block's hash
+        :return: Block object
+        """
+
+        block = object.__new__(cls)
+        object.__setattr__(block, "_serialized", None)
+        object.__setattr__(block, "_midstate", None)
+        object.__setattr__(block, "_hash", None)
+        block.__dict__.update(
+            index=index, transactions=transactions, timestamp=timestamp, previous_hash=previous_hash, nonce=nonce
+        )
+
+        return block
+
+    def __reduce__(self):
+        """Pickles only the block's fields; the cached serialization and hash are rebuilt on demand after loading."""
+
+        return Block, (self.index, self.transactions, self.previous_hash, self.timestamp, self.nonce)
+
     def compute_hash(self):
         """
         Computes the hash of the block.
@@ -86,9 +165,91 @@ class Block:
         :return: Returns the hash of the block as a string
         """
 
-        block_string = json.dumps(self.__dict__, sort_keys=True)
+        if self._hash is None:
+            _, suffix = self._split_at_nonce()
+
+            # hashlib's sha256 is OpenSSL's, which already dispatches to SHA-NI at runtime when the CPU supports it
+            attempt = self._midstate.copy()
+            attempt.update(b"%d%b" % (self.nonce, suffix))
+            self._hash = attempt.hexdigest()
+
+        return self._hash
+
+    def _split_at_nonce(self):
+        """
+        Serializes the block as sorted-key JSON, split around the nonce value, and hashes the part before the nonce
+        into _midstate. Both are cached until a field other than the nonce is reassigned, so transactions must be
+        replaced rather than mutated in place.
+
+        :return: Tuple of the bytes before and after the nonce
+        """
+
+        if self._serialized is None:
+            # Keys are sorted and "index" holds an int, so the first "nonce" key is the block's own
+            block_string = json.dumps(dict(self.__dict__, nonce=0), sort_keys=True)
+            prefix, _, suffix = block_string.partition('"nonce": 0')
+            self._serialized = (prefix + '"nonce": ').encode(), suffix.encode()
+            self._midstate = sha256(self._serialized[0])
+
+        return self._serialized
+
 
-        return sha256(block_string.encode()).hexdigest()
+def _search_nonce(prefix, suffix, target, nonce, stop=None):
+    """
+    Increments the nonce until the hash of the serialized block is below the target.
+
+    :param prefix: Serialized block bytes before the nonce
+    :param suffix: Serialized block bytes after the nonce
+    :param target: 32-byte big-endian value that a valid digest must sort below
+    :param nonce: First nonce to try
+    :param stop: Nonce to stop the search at, or None to search until a valid nonce is found
+    :return: Tuple of the valid nonce and its hash as a string; None if no nonce before stop is valid
+    """
+
+    # The prefix is hashed once; each attempt copies that state and only hashes the nonce and suffix
+    copy_midstate = sha256(prefix).copy
+
+    while nonce != stop:
+        attempt = copy_midstate()
+        attempt.update(b"%d%b" % (nonce, suffix))
+
+        if attempt.digest() < target:
+            return nonce, attempt.hexdigest()
+
+        nonce += 1
+
+    return None
+
+
+def _parallel_search_nonce(prefix, suffix, target, nonce, workers):
+    """
+    Searches for a valid nonce across worker processes. Each round hands every worker its own consecutive range of
+    nonces, and the lowest valid nonce of the first successful round is returned, which is the same nonce that
+    _search_nonce() would find.
+
+    :param prefix: Serialized block bytes before the nonce
+    :param suffix: Serialized block bytes after the nonce
+    :param target: 32-byte big-endian value that a valid digest must sort below
+    :param nonce: First nonce to try
+    :param workers: Number of worker processes
+    :return: Tuple of the valid nonce and its hash as a string
+    """
+
+    step = NONCES_PER_PROOF_OF_WORK_TASK
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            starts = range(nonce, nonce + workers * step, step)
+            futures = [executor.submit(_search_nonce, prefix, suffix, target, start, start + step) for start in starts]
+
+            # Ranges are in ascending order, so the first result found is the lowest valid nonce
+            for future in futures:
+                result = future.result()
+
+                if result is not None:
+                    return result
+
+            nonce += workers * step
 
 
 class Blockchain:
@@ -113,10 +274,8 @@ class Blockchain:
     def __dict__(self):
         """Returns blockchain attributes as a dictionary."""
 
-        chain_data = []
-
-        for block in self.chain:
-            chain_data.append(block.__dict__)
+        # Each block's __dict__ is its live attribute dictionary, so this only collects references without copying
+        chain_data = [block.__dict__ for block in self.chain]
 
         return {
             "difficulty": self.difficulty,
@@ -125,6 +284,24 @@ class Blockchain:
             "chain": chain_data,
         }
 
+    @property
+    def difficulty(self):
+        """Gets the number of leading zero hex digits a valid hash must have."""
+
+        return self._difficulty
+
+    @difficulty.setter
+    def difficulty(self, difficulty):
+        """
+        Sets the difficulty along with the target that a valid digest must sort below. Equal-length big-endian bytes
+        compare like the integers they encode, so checking a digest is a single bytes comparison.
+        """
+
+        self._difficulty = difficulty
+        self._target = (1 << max(256 - 4 * difficulty, 0)).to_bytes(32, "big")
+        # Lowercase hex strings of equal length also compare like the integers they encode
+        self._hex_target = self._target.hex()
+
     def _create_genesis_block(self):
         """Creates the first block, or "genesis" block in the blockchain."""
 
@@ -137,23 +314,70 @@ class Blockchain:
 
         return self.chain[-1]
 
-    def proof_of_work(self, block):
+    def copy(self):
+        """
+        Copies the blockchain down to its transaction dictionaries, so that nothing done to the copy, including changes
+        to its blocks, shows up in this one.
+
+        :return: Blockchain object
+        """
+
+        blockchain = Blockchain.__new__(Blockchain)
+        blockchain.difficulty = self.difficulty
+        blockchain.unconfirmed_transactions = [dict(transaction) for transaction in self.unconfirmed_transactions]
+        # The blocks' fields have already been checked, so they aren't checked again
+        blockchain.chain = [
+            Block._from_trusted(
+                index=block.index,
+                transactions=[dict(transaction) for transaction in block.transactions],
+                previous_hash=block.previous_hash,
+                timestamp=block.timestamp,
+                nonce=block.nonce,
+            )
+            for block in self.chain
+        ]
+
+        return blockchain
+
+    def proof_of_work(self, block, workers=1, start_nonce=None):
         """
         Solves for the block's nonce that will generate a valid hash.
 
         :param block: Block object
+        :param workers: Number of processes to search with; spawning them only pays off at high difficulties
+        :param start_nonce: First nonce to try; defaults to the block's current nonce
         :return: Valid hash of the block as a string
         """
 
         if not isinstance(block, Block):
             raise TypeError("ERROR: param block must be of type Block")
 
-        computed_hash = block.compute_hash()
+        if not isinstance(workers, int):
+            raise TypeError("ERROR: param workers must be of type int")
+
+        if workers <= 0:
+            raise ValueError("ERROR: param workers must be greater than 0")
 
-        # Increment nonce until the hash is valid
-        while not computed_hash.startswith("0" * self.difficulty):
-            block.nonce += 1
-            computed_hash = block.compute_hash()
+        if start_nonce is None:
+            start_nonce = block.nonce
+
+        elif not isinstance(start_nonce, int):
+            raise TypeError("ERROR: param start_nonce must be of type int")
+
+        elif start_nonce < 0:
+            raise ValueError("ERROR: param start_nonce must be greater than or equal to 0")
+
+        # Only the nonce changes between attempts, so serialize the rest of the block once
+        prefix, suffix = block._split_at_nonce()
+
+        if workers == 1:
+            block.nonce, computed_hash = _search_nonce(prefix, suffix, self._target, start_nonce)
+
+        else:
+            block.nonce, computed_hash = _parallel_search_nonce(prefix, suffix, self._target, start_nonce, workers)
+
+        # The search already produced the block's hash, so add_block() and is_valid_proof() can reuse it
+        block._hash = computed_hash
 
         return computed_hash
 
@@ -173,7 +397,9 @@ class Blockchain:
         if not isinstance(proof, str):
             raise TypeError("ERROR: param proof must be of type str")
 
-        return proof.startswith("0" * self.difficulty) and proof == block.compute_hash()
+        # Comparing against the block's hash first guarantees the proof is 64 lowercase hex digits, so it can be
+        # compared with the target as is rather than decoded back into bytes
+        return proof == block.compute_hash() and proof < self._hex_target
 
     def add_block(self, block, proof):
         """
@@ -222,7 +448,8 @@ class Blockchain:
         if not isinstance(amount, (int, float)):
             raise TypeError("ERROR: param amount must be an int or float")
 
-        transaction_details = Transaction(sender_id, receiver_id, timestamp, amount)
+        # The arguments were just checked, so don't check them again while constructing the transaction
+        transaction_details = Transaction._from_trusted(sender_id, receiver_id, timestamp, amount)
         self.unconfirmed_transactions.append(transaction_details.data)
 
         return transaction_details
@@ -253,39 +480,170 @@ class Blockchain:
         return True
 
 
+def _parse_block(block):
+    """
+    Constructs a Block object from its cached dictionary.
+
+    :param block: Dictionary of block attributes
+    :return: parsed Block object
+    """
+
+    # The cache file is only written by this package, so its fields are converted without being checked again
+    return Block._from_trusted(
+        index=int(block["index"]),
+        transactions=block["transactions"],
+        timestamp=float(block["timestamp"]),
+        previous_hash=block["previous_hash"],
+        nonce=int(block["nonce"]),
+    )
+
+
 def _parse_blockchain_from_txt_file(blockchain_txt_file=BLOCKCHAIN_CACHE_TXT_FILE):
     """
     Parses blockchain stored in cache/blockchain.txt to construct a Blockchain object.
 
+    The file is an append-only log with one JSON record per line. A record holding a "chain" is a full snapshot of the
+    blockchain, a "transaction" record adds an unconfirmed transaction, and a "block" record adds a mined block, which
+    confirms as many of the oldest unconfirmed transactions as it holds. A file holding a single indented snapshot, as
+    written by earlier versions, is also accepted; the app rewrites it as a one-line snapshot before appending to it.
+
     :param blockchain_txt_file: Path to the blockchain .txt file
     :return: parsed Blockchain object
     """
 
-    with open(blockchain_txt_file, "r") as file:
-        cached_blockchain = json.load(file)
+    with open(blockchain_txt_file, "rb") as file:
+        contents = file.read()
 
-    parsed_blockchain = Blockchain()
+    try:
+        records = [orjson.loads(contents)]
 
-    # Blockchain object initializes with a genesis block, so remove it
-    parsed_blockchain.chain.pop(0)
+    except orjson.JSONDecodeError:
+        # The last line is either empty or a record that is still being written, so it is skipped
+        records = [orjson.loads(line) for line in contents.split(b"\n")[:-1]]
 
-    parsed_blockchain.difficulty = int(cached_blockchain["difficulty"])
-    parsed_blockchain.unconfirmed_transactions = cached_blockchain["unconfirmed_transactions"]
+    parsed_blockchain = Blockchain()
 
-    for block in cached_blockchain["chain"]:
-        parsed_block = Block(
-            index=int(block["index"]),
-            transactions=block["transactions"],
-            timestamp=float(block["timestamp"]),
-            previous_hash=block["previous_hash"],
-            nonce=int(block["nonce"]),
-        )
+    for record in records:
+        if "chain" in record:
+            parsed_blockchain.difficulty = int(record["difficulty"])
+            parsed_blockchain.unconfirmed_transactions = record["unconfirmed_transactions"]
+            parsed_blockchain.chain = [_parse_block(block) for block in record["chain"]]
+
+        elif "transaction" in record:
+            parsed_blockchain.unconfirmed_transactions.append(record["transaction"])
 
-        parsed_blockchain.chain.append(parsed_block)
+        else:
+            parsed_blockchain.chain.append(_parse_block(record["block"]))
+            # Transactions sent while the block was being mined come after the ones it holds and stay unconfirmed
+            confirmed_transactions = len(record["block"]["transactions"])
+            parsed_blockchain.unconfirmed_transactions = parsed_blockchain.unconfirmed_transactions[
+                confirmed_transactions:
+            ]
 
     return parsed_blockchain
 
 
+# Log records are written with their single key first, so their kind can be told from the encoded bytes
+_BLOCK_RECORD_PREFIX = b'{"block"'
+_TRANSACTION_RECORD_PREFIX = b'{"transaction"'
+
+
+class BlockchainView:
+    """
+    Read-only summary of a cached blockchain. Records are only decoded once an attribute needs them, and no Block or
+    Transaction objects are built unless the last block is asked for.
+    """
+
+    def __init__(self, contents):
+        """
+        Constructs the BlockchainView instance.
+
+        :param contents: Bytes of the blockchain .txt file; empty if there is no cached blockchain
+        """
+
+        self._contents = contents
+
+    @functools.cached_property
+    def _records(self):
+        """The last snapshot in the cache file, decoded, and the encoded records that follow it."""
+
+        # A log line never contains a newline, so a file starting with one holds a single indented snapshot
+        if self._contents.startswith(b"{\n"):
+            lines = [self._contents]
+
+        else:
+            # The last line is either empty or a record that is still being written, so it is skipped
+            lines = self._contents.split(b"\n")[:-1]
+
+        for position in range(len(lines) - 1, -1, -1):
+            if not lines[position].startswith((_BLOCK_RECORD_PREFIX, _TRANSACTION_RECORD_PREFIX)):
+                return orjson.loads(lines[position]), lines[position + 1 :]
+
+        return None, lines
+
+    @functools.cached_property
+    def chain_length(self):
+        """Number of blocks in the chain, including the genesis block."""
+
+        snapshot, lines = self._records
+        chain_length = len(snapshot["chain"]) if snapshot is not None else 1
+
+        return chain_length + sum(line.startswith(_BLOCK_RECORD_PREFIX) for line in lines)
+
+    @functools.cached_property
+    def unconfirmed_transactions(self):
+        """List of unconfirmed transaction dictionaries."""
+
+        snapshot, lines = self._records
+        unconfirmed_transactions = snapshot["unconfirmed_transactions"] if snapshot is not None else []
+        unconfirmed_lines = []
+
+        # A block confirms as many of the oldest unconfirmed transactions as it holds, so transaction records are only
+        # decoded once it is known that no later block confirms them
+        for line in lines:
+            if line.startswith(_TRANSACTION_RECORD_PREFIX):
+                unconfirmed_lines.append(line)
+                continue
+
+            confirmed_transactions = len(orjson.loads(line)["block"]["transactions"])
+            confirmed_from_snapshot = min(confirmed_transactions, len(unconfirmed_transactions))
+            unconfirmed_transactions = unconfirmed_transactions[confirmed_from_snapshot:]
+            unconfirmed_lines = unconfirmed_lines[confirmed_transactions - confirmed_from_snapshot :]
+
+        return unconfirmed_transactions + [orjson.loads(line)["transaction"] for line in unconfirmed_lines]
+
+    @functools.cached_property
+    def last_block(self):
+        """The last Block in the chain."""
+
+        snapshot, lines = self._records
+
+        for line in reversed(lines):
+            if line.startswith(_BLOCK_RECORD_PREFIX):
+                return _parse_block(orjson.loads(line)["block"])
+
+        if snapshot is not None:
+            return _parse_block(snapshot["chain"][-1])
+
+        return Blockchain().last_block
+
+
+@functools.lru_cache(maxsize=1)
+def _parse_blockchain_from_txt_file_version(blockchain_txt_file, modification_time, size):
+    """
+    Parses a blockchain .txt file once per version of it. The modification time and size are only part of the
+    memoization key, so the file is parsed again whenever it has been written to. Only the latest version read is
+    kept, since the app itself only parses a file again once it has changed.
+
+    :param blockchain_txt_file: Path to the blockchain .txt file
+    :param modification_time: Modification time of the file in nanoseconds
+    :param size: Size of the file in bytes
+    :return: parsed Blockchain object, which must not be modified
+    """
+
+    return _parse_blockchain_from_txt_file(blockchain_txt_file)
+
+
 def get_current_blockchain(blockchain_txt_file=BLOCKCHAIN_CACHE_TXT_FILE):
     """
     If a cached Blockchain exists, return it. Otherwise, return a newly initialized Blockchain.
@@ -294,9 +652,37 @@ def get_current_blockchain(blockchain_txt_file=BLOCKCHAIN_CACHE_TXT_FILE):
     :return: Blockchain object
     """
 
+    try:
+        file_stat = os.stat(blockchain_txt_file)
+
+    except FileNotFoundError:
+        file_stat = None
+
     # Get cached blockchain if it exists
-    if os.path.exists(blockchain_txt_file) and os.path.getsize(blockchain_txt_file) > 0:
-        return _parse_blockchain_from_txt_file(blockchain_txt_file)
+    if file_stat is not None and file_stat.st_size > 0:
+        parsed_blockchain = _parse_blockchain_from_txt_file_version(
+            blockchain_txt_file, file_stat.st_mtime_ns, file_stat.st_size
+        )
+
+        # Callers are free to change what they get back, so they each get their own copy of the memoized blockchain
+        return parsed_blockchain.copy()
 
     # There is no cached blockchain, return a new one
     return Blockchain()
+
+
+def get_current_blockchain_summary(blockchain_txt_file=BLOCKCHAIN_CACHE_TXT_FILE):
+    """
+    Reads the cached blockchain without parsing it, for callers that only need a few of its attributes.
+
+    :param blockchain_txt_file: Path to the blockchain .txt file
+    :return: BlockchainView object
+    """
+
+    try:
+        with open(blockchain_txt_file, "rb") as file:
+            return BlockchainView(file.read())
+
+    except FileNotFoundError:
+        # There is no cached blockchain, so summarize a new one
+        return BlockchainView(b"")
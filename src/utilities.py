@@ -1,9 +1,24 @@
 import os
+import queue
+import threading
+import time
 
 BLOCKCHAIN_CACHE_TXT_FILE = os.getcwd() + "/cache/blockchain.txt"
 TEST_BLOCKCHAIN_CACHE_TXT_FILE = os.getcwd() + "/cache/test_blockchain.txt"
 DEFAULT_DIFFICULTY = 3
 MINIMUM_NUMBER_OF_TRANSACTIONS_PER_BLOCK = 3
+NONCES_PER_PROOF_OF_WORK_TASK = 100000
+CACHE_WRITER_MAX_BATCH_SIZE = 100
+CACHE_WRITER_MAX_BATCH_DELAY = 0.05
+
+# Fields of a valid transaction and the types each one accepts
+_TRANSACTION_FIELD_TYPES = (
+    ("sender_id", str),
+    ("receiver_id", str),
+    ("timestamp", float),
+    ("amount", (int, float)),
+)
+_TRANSACTION_KEYS = frozenset(key for key, _ in _TRANSACTION_FIELD_TYPES)
 
 
 def check_data_is_valid_transaction(data):
@@ -14,44 +29,130 @@ def check_data_is_valid_transaction(data):
     :return: True if data is a valid transaction; False otherwise
     """
 
-    if not isinstance(data, dict):
-        print("data is not of type dict")
+    # Comparing the keys against a set checks both that every field is present and that there are no extras
+    if not isinstance(data, dict) or data.keys() != _TRANSACTION_KEYS:
         return False
 
-    if len(data) != 4:
-        print("len(data) is not equal to 4")
-        return False
+    return all(isinstance(data[key], types) for key, types in _TRANSACTION_FIELD_TYPES)
 
-    if "sender_id" not in data:
-        print("sender_id not in data")
-        return False
 
-    if "receiver_id" not in data:
-        print("receiver_id not in data")
-        return False
+class BlockchainCacheWriter:
+    """
+    Appends data to blockchain cache files from a background thread. Writes that arrive close together are grouped
+    into a single write and fsync per file, so a burst of transactions costs one disk flush instead of one each.
+    """
 
-    if "timestamp" not in data:
-        print("timestamp not in data")
-        return False
+    def __init__(
+        self, on_write=None, max_batch_size=CACHE_WRITER_MAX_BATCH_SIZE, max_batch_delay=CACHE_WRITER_MAX_BATCH_DELAY
+    ):
+        """
+        Constructs the BlockchainCacheWriter instance and starts its writer thread.
 
-    if "amount" not in data:
-        print("amount not in data")
-        return False
+        :param on_write: Callable taking the file path, the token the writes were queued with, the number of those
+            writes made and the OSError raised while writing (None on success), called from the writer thread once
+            for each token after each batch
+        :param max_batch_size: Most writes grouped into one batch
+        :param max_batch_delay: Most seconds to wait for more writes before flushing a batch
+        """
 
-    if not isinstance(data["sender_id"], str):
-        print("sender_id is not of type str")
-        return False
+        self.on_write = on_write
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self._queue = queue.Queue()
+        threading.Thread(target=self._write_batches, daemon=True).start()
 
-    if not isinstance(data["receiver_id"], str):
-        print("receiver_id is not of type str")
-        return False
+    def enqueue(self, filepath, data, token=None):
+        """
+        Queues bytes to be appended to a file.
 
-    if not isinstance(data["timestamp"], float):
-        print("timestamp is not of type float")
-        return False
+        :param filepath: Path to the file
+        :param data: Bytes to append
+        :param token: Object passed back to on_write with the result, e.g. whatever the write was made on behalf of
+        :return: None
+        """
 
-    if not isinstance(data["amount"], (int, float)):
-        print("amount is not of type int or float")
-        return False
+        self._queue.put((filepath, data, token))
+
+    def flush(self):
+        """
+        Writes every queued item to disk right away and waits until they are written.
+
+        :return: None
+        """
+
+        # None ends the batch being collected instead of waiting out the delay
+        self._queue.put(None)
+        self._queue.join()
+
+    def _collect_batch(self):
+        """
+        Waits for a queued write, then gathers whatever follows it until the batch is full, the delay is up or a flush
+        is requested.
+
+        :return: Tuple of the (filepath, data, token) items in the batch and how many items were taken off the queue
+        """
+
+        batch = []
+        item = self._queue.get()
+        items_taken = 1
+        deadline = time.monotonic() + self.max_batch_delay
+
+        while item is not None:
+            batch.append(item)
+
+            if len(batch) >= self.max_batch_size:
+                break
+
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+
+            except queue.Empty:
+                break
+
+            items_taken += 1
+
+        return batch, items_taken
+
+    def _write_batches(self):
+        """Writes batches of queued data until the process exits."""
+
+        while True:
+            batch, items_taken = self._collect_batch()
+            writes_by_filepath = {}
+
+            for filepath, data, token in batch:
+                writes_by_filepath.setdefault(filepath, []).append((data, token))
+
+            for filepath, writes in writes_by_filepath.items():
+                error = None
+
+                try:
+                    file_descriptor = os.open(filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+                    try:
+                        unwritten = memoryview(b"".join(data for data, _ in writes))
+
+                        # os.write() may write only part of the data, e.g. when the disk is nearly full, so the rest
+                        # is written until it is all in the file or the write raises
+                        while unwritten:
+                            unwritten = unwritten[os.write(file_descriptor, unwritten) :]
+
+                        os.fsync(file_descriptor)
+
+                    finally:
+                        os.close(file_descriptor)
+
+                except OSError as exception:
+                    error = exception
+
+                if self.on_write is not None:
+                    writes_by_token = {}
+
+                    for _, token in writes:
+                        writes_by_token[token] = writes_by_token.get(token, 0) + 1
+
+                    for token, token_writes in writes_by_token.items():
+                        self.on_write(filepath, token, token_writes, error)
 
-    return True
+            for _ in range(items_taken):
+                self._queue.task_done()
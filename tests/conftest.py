@@ -0,0 +1,29 @@
+import os
+import shutil
+import tempfile
+
+import src.utilities
+
+# Temporary directory holding the test blockchain cache for the duration of the test session
+_test_cache_directory = None
+
+
+def pytest_configure(config):
+    """
+    Points the test blockchain cache at a temporary directory before any test module imports it, using the in-memory
+    /dev/shm when it is available so the application tests never touch the disk.
+    """
+
+    global _test_cache_directory
+
+    _test_cache_directory = tempfile.mkdtemp(
+        prefix="test_blockchain_cache_", dir="/dev/shm" if os.path.isdir("/dev/shm") else None
+    )
+    src.utilities.TEST_BLOCKCHAIN_CACHE_TXT_FILE = os.path.join(_test_cache_directory, "test_blockchain.txt")
+
+
+def pytest_unconfigure(config):
+    """Removes the temporary test blockchain cache."""
+
+    if _test_cache_directory is not None:
+        shutil.rmtree(_test_cache_directory, ignore_errors=True)
@@ -1,12 +1,16 @@
 import os
 import random
+import shutil
 import string
+import threading
 import time
 
+import orjson
 import pytest
 
-from application import app
-from src.blockchain import get_current_blockchain
+import application
+from application import app, cache_writer, mining_queue
+from src.blockchain import Blockchain, get_current_blockchain, get_current_blockchain_summary
 from src.utilities import MINIMUM_NUMBER_OF_TRANSACTIONS_PER_BLOCK, TEST_BLOCKCHAIN_CACHE_TXT_FILE
 
 app.config["TESTING"] = True
@@ -16,32 +20,47 @@ app.config["TESTING"] = True
 def clear_blockchain_cache():
     """Clears the blockchain cache before each test."""
 
-    with open(TEST_BLOCKCHAIN_CACHE_TXT_FILE, "w") as file:
-        time.sleep(1)
+    # Let the previous test's background mining and cache writes finish so they can't write into the cleared cache
+    mining_queue.join()
+    cache_writer.flush()
+
+    # Truncating changes the file's size, which is enough for the app to notice and reload its cached blockchain
+    try:
+        os.truncate(TEST_BLOCKCHAIN_CACHE_TXT_FILE, 0)
+
+    except FileNotFoundError:
+        open(TEST_BLOCKCHAIN_CACHE_TXT_FILE, "wb").close()
+
+
+@pytest.fixture(scope="class")
+def client():
+    """Test client shared by every test in a class."""
+
+    return app.test_client()
 
 
 class TestAppRouteGetChain:
-    def test_get_chain(self):
+    def test_get_chain(self, client):
         """Tests that the /chain app route works as intended."""
-        response = app.test_client().get("/chain")
+        response = client.get("/chain")
 
         assert response.status_code == 200
         assert isinstance(response.data.decode("utf-8"), str)
 
-    def test_get_chain_multiple_requests_per_second(self):
+    def test_get_chain_multiple_requests_per_second(self, client):
         """Tests that the /chain app route can handle multiple requests per second successfully."""
 
         number_of_iterations = 100
 
         for iteration in range(number_of_iterations):
-            response = app.test_client().get("/chain")
+            response = client.get("/chain")
 
             assert response.status_code == 200
-            assert isinstance(response.data.decode("utf-8"), str)
+            assert response.data
 
 
 class TestAppRouteAddTransactionToBlockchain:
-    def test_add_valid_transaction(self):
+    def test_add_valid_transaction(self, client):
         """Tests that the /send app route returns status code 200 with a valid transaction."""
 
         sender_id = "0x1234ABCD"
@@ -51,7 +70,7 @@ class TestAppRouteAddTransactionToBlockchain:
 
         transaction = {"sender_id": sender_id, "receiver_id": receiver_id, "timestamp": timestamp, "amount": amount}
 
-        response = app.test_client().post("/send", json=transaction)
+        response = client.post("/send", json=transaction)
         data = response.data.decode("utf-8")
 
         assert response.status_code == 200
@@ -62,13 +81,14 @@ class TestAppRouteAddTransactionToBlockchain:
         assert str(amount) in data
 
         # Check that there are 0 blocks and 1 unconfirmed transaction added to the blockchain
-        blockchain = get_current_blockchain(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
+        cache_writer.flush()
+        blockchain = get_current_blockchain_summary(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
 
         # Exclude genesis block
-        assert len(blockchain.chain) - 1 == 0
+        assert blockchain.chain_length - 1 == 0
         assert len(blockchain.unconfirmed_transactions) == 1
 
-    def test_add_invalid_transaction(self):
+    def test_add_invalid_transaction(self, client):
         """Tests that the /send app route returns status code 400 with an invalid transaction."""
 
         # Send sender_id as an int instead of a str to create invalid transaction
@@ -79,7 +99,7 @@ class TestAppRouteAddTransactionToBlockchain:
 
         transaction = {"sender_id": sender_id, "receiver_id": receiver_id, "timestamp": timestamp, "amount": amount}
 
-        response = app.test_client().post("/send", json=transaction)
+        response = client.post("/send", json=transaction)
         data = response.data.decode("utf-8")
 
         assert response.status_code == 400
@@ -87,13 +107,14 @@ class TestAppRouteAddTransactionToBlockchain:
         assert "Invalid Transaction!" in data
 
         # Check that there are 0 blocks and 0 unconfirmed transaction added to the blockchain
-        blockchain = get_current_blockchain(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
+        cache_writer.flush()
+        blockchain = get_current_blockchain_summary(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
 
         # Exclude genesis block
-        assert len(blockchain.chain) - 1 == 0
+        assert blockchain.chain_length - 1 == 0
         assert len(blockchain.unconfirmed_transactions) == 0
 
-    def test_add_min_number_of_transactions_per_block_creates_new_block(self):
+    def test_add_min_number_of_transactions_per_block_creates_new_block(self, client):
         sender_id = "0x1234ABCD"
         receiver_id = "0xABCD1234"
         amount = 99999.99
@@ -103,48 +124,143 @@ class TestAppRouteAddTransactionToBlockchain:
 
             transaction = {"sender_id": sender_id, "receiver_id": receiver_id, "timestamp": timestamp, "amount": amount}
 
-            response = app.test_client().post("/send", json=transaction)
+            response = client.post("/send", json=transaction)
             assert response.status_code == 200
 
-        blockchain = get_current_blockchain(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
+        mining_queue.join()
+        cache_writer.flush()
+        blockchain = get_current_blockchain_summary(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
 
         # Exclude genesis block
-        assert len(blockchain.chain) - 1 == 1
+        assert blockchain.chain_length - 1 == 1
         assert len(blockchain.unconfirmed_transactions) == 0
 
-    def test_add_multiple_valid_transactions_per_second(self):
+    def test_requests_are_served_while_mining(self, client, monkeypatch):
+        """Tests that /chain and /send respond while a block is mined, and transactions sent meanwhile stay unconfirmed."""
+
+        mining_started = threading.Event()
+        finish_mining = threading.Event()
+        proof_of_work = Blockchain.proof_of_work
+
+        def paused_proof_of_work(blockchain, block, *args, **kwargs):
+            mining_started.set()
+            finish_mining.wait()
+            return proof_of_work(blockchain, block, *args, **kwargs)
+
+        monkeypatch.setattr(Blockchain, "proof_of_work", paused_proof_of_work)
+
+        for iteration in range(MINIMUM_NUMBER_OF_TRANSACTIONS_PER_BLOCK):
+            transaction = {"sender_id": "0x1234ABCD", "receiver_id": "0xABCD1234", "timestamp": 0.0, "amount": 1.0}
+            assert client.post("/send", json=transaction).status_code == 200
+
+        assert mining_started.wait(timeout=10)
+
+        # Send the requests from another thread so the test fails rather than hangs if they wait on the miner
+        responses = []
+        transaction = {"sender_id": "0x1234ABCD", "receiver_id": "0xABCD1234", "timestamp": 1.0, "amount": 2.0}
+        requester = threading.Thread(
+            target=lambda: responses.extend(
+                (app.test_client().get("/chain"), app.test_client().post("/send", json=transaction))
+            )
+        )
+        requester.start()
+        requester.join(timeout=10)
+        finish_mining.set()
+
+        assert not requester.is_alive()
+        assert [response.status_code for response in responses] == [200, 200]
+
+        mining_queue.join()
+        cache_writer.flush()
+        blockchain = get_current_blockchain_summary(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
+
+        # Exclude genesis block
+        assert blockchain.chain_length - 1 == 1
+        assert len(blockchain.last_block.transactions) == MINIMUM_NUMBER_OF_TRANSACTIONS_PER_BLOCK
+        assert blockchain.unconfirmed_transactions == [transaction]
+
+    def test_add_transaction_to_indented_cache(self, client):
+        """Tests that /send converts a cache holding an indented snapshot before appending to it."""
+
+        shutil.copyfile(os.getcwd() + "/cache/sample_blockchain.txt", TEST_BLOCKCHAIN_CACHE_TXT_FILE)
+        sample_blockchain = get_current_blockchain(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
+
+        # The sample has one transaction fewer than a block needs, so this also mines a block
+        transaction = {"sender_id": "0x1234ABCD", "receiver_id": "0xABCD1234", "timestamp": 0.0, "amount": 1.0}
+        assert client.post("/send", json=transaction).status_code == 200
+
+        mining_queue.join()
+        cache_writer.flush()
+        blockchain = get_current_blockchain(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
+        blockchain_summary = get_current_blockchain_summary(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
+
+        assert len(blockchain.chain) == blockchain_summary.chain_length == len(sample_blockchain.chain) + 1
+        assert blockchain.unconfirmed_transactions == blockchain_summary.unconfirmed_transactions == []
+        assert blockchain.last_block.transactions == sample_blockchain.unconfirmed_transactions + [transaction]
+        assert blockchain.chain[-2].compute_hash() == sample_blockchain.last_block.compute_hash()
+
+    def test_add_transaction_to_cache_with_torn_record(self, client):
+        """Tests that /send cuts a partly written last record off the cache before appending to it."""
+
+        blockchain = Blockchain()
+        transaction = {"sender_id": "0x1234ABCD", "receiver_id": "0xABCD1234", "timestamp": 0.0, "amount": 1.0}
+        records = [blockchain.__dict__(), {"transaction": transaction}]
+
+        with open(TEST_BLOCKCHAIN_CACHE_TXT_FILE, "wb") as file:
+            file.write(b"".join(orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE) for record in records))
+            file.write(b'{"transaction":{"sender_id":"a","rec')
+
+        assert client.post("/send", json=transaction).status_code == 200
+
+        mining_queue.join()
+        cache_writer.flush()
+        blockchain = get_current_blockchain(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
+        blockchain_summary = get_current_blockchain_summary(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
+
+        assert len(blockchain.chain) == blockchain_summary.chain_length == 1
+        assert blockchain.unconfirmed_transactions == blockchain_summary.unconfirmed_transactions == [transaction] * 2
+
+    def test_add_multiple_valid_transactions_per_second(self, client):
         """Tests that the /send app route returns status code 200 with a multiple valid transactions per second."""
 
         number_of_iterations = 100
         sender_id = "0x1234ABCD"
         receiver_id = "0xABCD1234"
 
+        # Only the timestamp and amount change between requests, so the body is formatted from a template. %a inserts
+        # repr(), which writes a float as a JSON number that parses back to exactly the same value.
+        payload_template = b'{"sender_id": "%b", "receiver_id": "%b", ' % (sender_id.encode(), receiver_id.encode())
+        payload_template += b'"timestamp": %a, "amount": %a}'
+
         for iteration in range(number_of_iterations):
             timestamp = time.time()
             amount = 99999.99 + iteration
 
-            transaction = {"sender_id": sender_id, "receiver_id": receiver_id, "timestamp": timestamp, "amount": amount}
+            response = client.post(
+                "/send", data=payload_template % (timestamp, amount), content_type="application/json"
+            )
+            body = response.data
 
-            response = app.test_client().post("/send", json=transaction)
-            data = response.data.decode("utf-8")
+            # Wait for any queued mining so each block holds exactly the minimum number of transactions
+            mining_queue.join()
 
             assert response.status_code == 200
-            assert isinstance(data, str)
-            assert sender_id in data
-            assert receiver_id in data
-            assert str(timestamp) in data
-            assert str(amount) in data
+            assert sender_id.encode() in body
+            assert receiver_id.encode() in body
+            assert str(timestamp).encode() in body
+            assert str(amount).encode() in body
 
         # Check that the correct number of blocks and unconfirmed transactions have been added to the blockchain
-        blockchain = get_current_blockchain(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
+        cache_writer.flush()
+        blockchain = get_current_blockchain_summary(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
 
         blocks, unconfirmed_transactions = divmod(number_of_iterations, MINIMUM_NUMBER_OF_TRANSACTIONS_PER_BLOCK)
 
         # Exclude genesis block
-        assert len(blockchain.chain) - 1 == blocks
+        assert blockchain.chain_length - 1 == blocks
         assert len(blockchain.unconfirmed_transactions) == unconfirmed_transactions
 
-    def test_add_multiple_invalid_transactions_per_second(self):
+    def test_add_multiple_invalid_transactions_per_second(self, client):
         """Tests that the /send app route returns status code 400 with a multiple invalid transactions per second."""
 
         number_of_iterations = 100
@@ -159,22 +275,22 @@ class TestAppRouteAddTransactionToBlockchain:
 
             transaction = {"sender_id": sender_id, "receiver_id": receiver_id, "timestamp": timestamp, "amount": amount}
 
-            response = app.test_client().post("/send", json=transaction)
-            data = response.data.decode("utf-8")
+            response = client.post("/send", json=transaction)
+            body = response.data
 
             assert response.status_code == 400
-            assert isinstance(data, str)
-            assert "Invalid Transaction!" in data
+            assert b"Invalid Transaction!" in body
 
         # Check that there are no added blocks or unconfirmed transactions in the blockchain
-        blockchain = get_current_blockchain(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
+        cache_writer.flush()
+        blockchain = get_current_blockchain_summary(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
 
         # Exclude genesis block
-        assert len(blockchain.chain) - 1 == 0
+        assert blockchain.chain_length - 1 == 0
         assert len(blockchain.unconfirmed_transactions) == 0
 
     @pytest.mark.parametrize("invalid_pct,valid_pct", [(0, 100), (20, 80), (40, 60), (60, 40), (80, 20), (100, 0)])
-    def test_add_multiple_valid_and_invalid_transactions_per_second(self, invalid_pct, valid_pct):
+    def test_add_multiple_valid_and_invalid_transactions_per_second(self, client, invalid_pct, valid_pct):
         """
         Tests that the /send app route returns appropriate status codes with a mix of multiple valid/invalid
         transactions per second.
@@ -190,48 +306,49 @@ class TestAppRouteAddTransactionToBlockchain:
         receiver_id = "0xABCD1234"
 
         sender_id_list = [valid_sender_id, invalid_sender_id]
-        weights = [invalid_pct / 100.0, valid_pct / 100.0]
+        weights = [valid_pct / 100.0, invalid_pct / 100.0]
+
+        # Choose every sender_id up front based on a weighted probability, seeded so each run sends the same mix
+        sender_ids = random.Random(0).choices(sender_id_list, weights=weights, k=number_of_iterations)
 
         valid_transactions = 0
         invalid_transactions = 0
 
-        for iteration in range(number_of_iterations):
-            # Choose sender_id based on a weighted probability
-            sender_id = random.choices(sender_id_list, weights=weights)[0]
-            print(sender_id)
-
+        for iteration, sender_id in enumerate(sender_ids):
             timestamp = time.time()
             amount = 99999.99 + iteration
 
             transaction = {"sender_id": sender_id, "receiver_id": receiver_id, "timestamp": timestamp, "amount": amount}
 
-            response = app.test_client().post("/send", json=transaction)
-            data = response.data.decode("utf-8")
+            response = client.post("/send", json=transaction)
+            body = response.data
+
+            # Wait for any queued mining so each block holds exactly the minimum number of transactions
+            mining_queue.join()
 
             # Invalid transaction
             if sender_id == invalid_sender_id:
                 assert response.status_code == 400
-                assert isinstance(data, str)
-                assert "Invalid Transaction!" in data
+                assert b"Invalid Transaction!" in body
                 invalid_transactions += 1
 
             # Valid transaction
             else:
                 assert response.status_code == 200
-                assert isinstance(data, str)
-                assert valid_sender_id in data
-                assert receiver_id in data
-                assert str(timestamp) in data
-                assert str(amount) in data
+                assert valid_sender_id.encode() in body
+                assert receiver_id.encode() in body
+                assert str(timestamp).encode() in body
+                assert str(amount).encode() in body
                 valid_transactions += 1
 
         # Check that the correct number of blocks and unconfirmed transactions have been added to the blockchain
-        blockchain = get_current_blockchain(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
+        cache_writer.flush()
+        blockchain = get_current_blockchain_summary(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
 
         blocks, unconfirmed_transactions = divmod(valid_transactions, MINIMUM_NUMBER_OF_TRANSACTIONS_PER_BLOCK)
 
         # Exclude genesis block
-        assert len(blockchain.chain) - 1 == blocks
+        assert blockchain.chain_length - 1 == blocks
         assert len(blockchain.unconfirmed_transactions) == unconfirmed_transactions
 
         # Log the actual percentages of each operation
@@ -239,8 +356,85 @@ class TestAppRouteAddTransactionToBlockchain:
         print(f"Percent of Invalid Transactions = {invalid_transactions/number_of_iterations * 100}%")
 
 
+class TestAppRouteAddTransactionsToBlockchainInBatch:
+    def test_add_valid_transactions_batch(self, client):
+        """Tests that the /send_batch app route adds every transaction in a valid batch and mines them together."""
+
+        number_of_transactions = 100
+        timestamp = time.time()
+        transactions = [
+            {"sender_id": "0x1234ABCD", "receiver_id": "0xABCD1234", "timestamp": timestamp, "amount": 99999.99 + index}
+            for index in range(number_of_transactions)
+        ]
+
+        response = client.post("/send_batch", json=transactions)
+
+        assert response.status_code == 200
+        assert orjson.loads(response.data) == transactions
+
+        # Every transaction is unconfirmed when the batch is queued for mining, so they all end up in one block
+        mining_queue.join()
+        cache_writer.flush()
+        blockchain = get_current_blockchain_summary(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
+
+        # Exclude genesis block
+        assert blockchain.chain_length - 1 == 1
+        assert len(blockchain.unconfirmed_transactions) == 0
+        assert blockchain.last_block.transactions == transactions
+
+    @pytest.mark.parametrize(
+        "data",
+        [
+            {"sender_id": "0x1234ABCD", "receiver_id": "0xABCD1234", "timestamp": 0.0, "amount": 0.0},
+            [
+                {"sender_id": "0x1234ABCD", "receiver_id": "0xABCD1234", "timestamp": 0.0, "amount": 0.0},
+                {"sender_id": 0x00000001, "receiver_id": "0xABCD1234", "timestamp": 0.0, "amount": 0.0},
+            ],
+        ],
+    )
+    def test_add_invalid_transactions_batch(self, client, data):
+        """Tests that the /send_batch app route adds nothing when the batch isn't a list of valid transactions."""
+
+        response = client.post("/send_batch", json=data)
+
+        assert response.status_code == 400
+        assert b"Invalid Transaction!" in response.data
+
+        # Check that there are no added blocks or unconfirmed transactions in the blockchain
+        cache_writer.flush()
+        blockchain = get_current_blockchain_summary(TEST_BLOCKCHAIN_CACHE_TXT_FILE)
+
+        # Exclude genesis block
+        assert blockchain.chain_length - 1 == 0
+        assert len(blockchain.unconfirmed_transactions) == 0
+
+
+class TestAppBlockchainCache:
+    def test_failed_cache_write_drops_blockchain_once_writes_finish(self, tmp_path):
+        """
+        Tests that a blockchain whose cache write failed is only dropped once its other queued writes have finished,
+        and that its writes are counted against it rather than against the blockchain loaded in its place.
+        """
+
+        blockchain_cache_filepath = str(tmp_path / "blockchain.txt")
+        cached = application._load_blockchain(blockchain_cache_filepath)
+        cached.pending_writes = 2
+
+        application._on_cache_written(blockchain_cache_filepath, cached, 1, OSError("disk full"))
+
+        # Another write is still queued, so reloading now could let it land in a file that was already parsed
+        assert application._load_blockchain(blockchain_cache_filepath) is cached
+
+        application._on_cache_written(blockchain_cache_filepath, cached, 1, None)
+        reloaded = application._load_blockchain(blockchain_cache_filepath)
+
+        assert reloaded is not cached
+        assert cached.pending_writes == 0
+        assert reloaded.pending_writes == 0
+
+
 class TestAppInvalidRoutes:
-    def test_invalid_route(self):
+    def test_invalid_route(self, client):
         """Verifies that invalid app routes return 404 status code."""
 
         number_of_iterations = 10
@@ -249,5 +443,5 @@ class TestAppInvalidRoutes:
             # Generate random strings of length 10
             random_string = "".join(random.choices(string.ascii_uppercase + string.digits, k=10))
 
-            response = app.test_client().get("/" + random_string)
+            response = client.get("/" + random_string)
             assert response.status_code == 404
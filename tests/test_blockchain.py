@@ -1,11 +1,16 @@
+import json
 import os
+import pickle
 import time
 
 import pytest
 
-from src.blockchain import Block, Blockchain, Transaction, get_current_blockchain
+from src.blockchain import Block, Blockchain, Transaction, get_current_blockchain, get_current_blockchain_summary
 from src.utilities import DEFAULT_DIFFICULTY, MINIMUM_NUMBER_OF_TRANSACTIONS_PER_BLOCK
 
+# Stress tests, which can be skipped with: pytest -m "not slow"
+slow = pytest.mark.slow
+
 
 class TestTransaction:
     def test_initialize_transaction_invalid_parameters(self):
@@ -89,6 +94,17 @@ class TestBlock:
         assert isinstance(block_hash, str)
         assert len(block_hash) > 0
 
+    def test_pickle_block(self):
+        """Tests a Block with a cached hash pickles without its cache and keeps its hash."""
+
+        block = Block(0, [], "0xFFFFFFFF", time.time(), 0)
+        block_hash = block.compute_hash()
+
+        unpickled_block = pickle.loads(pickle.dumps(block, protocol=5))
+
+        assert unpickled_block.__dict__ == block.__dict__
+        assert unpickled_block.compute_hash() == block_hash
+
 
 class TestBlockchain:
     def test_initialize_blockchain_invalid_parameters(self):
@@ -143,6 +159,22 @@ class TestBlockchain:
             blockchain.proof_of_work("block")
             assert "ERROR: param block must be of type Block" in str(err.value)
 
+        with pytest.raises(TypeError) as err:
+            blockchain.proof_of_work(Block(1, [], "0xFFFFFFFF", time.time(), 0), "2")
+            assert "ERROR: param workers must be of type int" in str(err.value)
+
+        with pytest.raises(ValueError) as err:
+            blockchain.proof_of_work(Block(1, [], "0xFFFFFFFF", time.time(), 0), 0)
+            assert "ERROR: param workers must be greater than 0" in str(err.value)
+
+        with pytest.raises(TypeError) as err:
+            blockchain.proof_of_work(Block(1, [], "0xFFFFFFFF", time.time(), 0), start_nonce="2")
+            assert "ERROR: param start_nonce must be of type int" in str(err.value)
+
+        with pytest.raises(ValueError) as err:
+            blockchain.proof_of_work(Block(1, [], "0xFFFFFFFF", time.time(), 0), start_nonce=-1)
+            assert "ERROR: param start_nonce must be greater than or equal to 0" in str(err.value)
+
     def test_proof_of_work(self):
         """Tests Blockchain.proof_of_work() is as expected."""
 
@@ -156,6 +188,34 @@ class TestBlockchain:
         assert computed_hash.startswith("0" * blockchain.difficulty)
         assert block.nonce > 0
 
+    def test_proof_of_work_start_nonce(self):
+        """Tests Blockchain.proof_of_work() searches from start_nonce onwards."""
+
+        blockchain = Blockchain()
+        block = Block(1, [], "0xFFFFFFFF", time.time(), 0)
+        blockchain.proof_of_work(block)
+
+        start_nonce = block.nonce + 1
+        computed_hash = blockchain.proof_of_work(block, start_nonce=start_nonce)
+
+        assert block.nonce >= start_nonce
+        assert blockchain.is_valid_proof(block, computed_hash)
+
+    def test_proof_of_work_multiple_workers(self):
+        """Tests Blockchain.proof_of_work() with multiple workers finds the same nonce as a single worker."""
+
+        blockchain = Blockchain()
+        timestamp = time.time()
+        block = Block(1, [], "0xFFFFFFFF", timestamp, 0)
+        parallel_block = Block(1, [], "0xFFFFFFFF", timestamp, 0)
+
+        computed_hash = blockchain.proof_of_work(block)
+        parallel_computed_hash = blockchain.proof_of_work(parallel_block, workers=2)
+
+        assert parallel_computed_hash == computed_hash
+        assert parallel_block.nonce == block.nonce
+        assert blockchain.is_valid_proof(parallel_block, parallel_computed_hash)
+
     def test_is_valid_proof_invalid_parameters(self):
         """Tests Blockchain.is_valid_proof() with invalid parameters fails as expected."""
 
@@ -237,15 +297,21 @@ class TestBlockchain:
         assert blockchain.last_block is block
         assert len(blockchain.chain) == 2
 
+    @slow
     def test_add_block_stress_test(self):
         """Tests Blockchain.add_block() by adding 1000 blocks into the blockchain."""
 
         blockchain = Blockchain()
         iterations = 1000
+        start_timestamp = time.time()
+        timestamps = [start_timestamp + index * 1e-6 for index in range(iterations + 1)]
+        start_nonce = 0
 
         for index in range(1, iterations + 1):
-            block = Block(index, [], blockchain.last_block.compute_hash(), time.time(), 0)
-            proof = blockchain.proof_of_work(block)
+            block = Block(index, [], blockchain.last_block.compute_hash(), timestamps[index], 0)
+            # Any nonce is as likely as another to be valid, so carry on from just past the previous block's
+            proof = blockchain.proof_of_work(block, start_nonce=start_nonce)
+            start_nonce = block.nonce + 1
 
             assert blockchain.add_block(block, proof)
             assert blockchain.last_block is block
@@ -287,14 +353,17 @@ class TestBlockchain:
         assert isinstance(blockchain.unconfirmed_transactions[0], dict)
         assert transaction.data == blockchain.unconfirmed_transactions[0]
 
+    @slow
     def test_add_new_transaction_stress_test(self):
         """Tests Blockchain.add_new_transaction() by adding 1000 transactions into the list."""
 
         blockchain = Blockchain()
         iterations = 1000
+        timestamp = time.time()
+        amounts = [9.99 * iteration for iteration in range(iterations + 1)]
 
         for iteration in range(1, iterations + 1):
-            transaction = blockchain.add_new_transaction("0xFFFFFFFF", "0x1FFFFFFF", time.time(), 9.99 * iteration)
+            transaction = blockchain.add_new_transaction("0xFFFFFFFF", "0x1FFFFFFF", timestamp, amounts[iteration])
 
             assert isinstance(transaction, Transaction)
             assert isinstance(transaction.sender_id, str)
@@ -348,15 +417,18 @@ class TestBlockchain:
         assert blockchain.last_block.timestamp >= previous_block_timestamp
         assert blockchain.last_block.transactions == current_transactions
 
+    @slow
     def test_mine_stress_test(self):
         """Tests Blockchain.mine() is as expected after mining 1000 times successfully."""
 
         blockchain = Blockchain()
         iterations = 1000
+        timestamp = time.time()
+        amounts = [9.99 * transaction_number for transaction_number in range(MINIMUM_NUMBER_OF_TRANSACTIONS_PER_BLOCK)]
 
         for iteration in range(1, iterations + 1):
-            for transaction_number in range(MINIMUM_NUMBER_OF_TRANSACTIONS_PER_BLOCK):
-                blockchain.add_new_transaction("0xFFFFFFFF", "0x1FFFFFFF", time.time(), 9.99 * transaction_number)
+            for amount in amounts:
+                blockchain.add_new_transaction("0xFFFFFFFF", "0x1FFFFFFF", timestamp, amount)
 
             previous_block_index = blockchain.last_block.index
             previous_block_hash = blockchain.last_block.compute_hash()
@@ -435,3 +507,128 @@ def test_get_cached_blockchain_valid_cache_file():
         cached_blockchain.last_block.previous_hash == "00003638464f452c5e9df0de5fb20fbad4b02b1b6698d8789246139efeb65965"
     )
     assert cached_blockchain.last_block.nonce == 1689
+
+
+@pytest.fixture
+def append_only_log(tmp_path):
+    """
+    Writes an append-only log of a snapshot, a transaction, a block confirming it, another transaction and an
+    incomplete trailing record.
+
+    :return: Tuple of the log's path, the snapshot's Blockchain object, the logged Block object and the transaction
+    """
+
+    blockchain = Blockchain()
+    transaction = {"sender_id": "A", "receiver_id": "B", "timestamp": 0.0, "amount": 0.0}
+    block = Block(1, [transaction], blockchain.last_block.compute_hash(), 0.0, 0)
+    blockchain.proof_of_work(block)
+
+    records = [
+        blockchain.__dict__(),
+        {"transaction": transaction},
+        {"block": block.__dict__},
+        {"transaction": transaction},
+    ]
+
+    test_cache_file = tmp_path / "blockchain.txt"
+    test_cache_file.write_text("".join(json.dumps(record) + "\n" for record in records) + '{"transac')
+
+    return str(test_cache_file), blockchain, block, transaction
+
+
+def test_get_cached_blockchain_append_only_log(append_only_log):
+    """Tests that get_current_blockchain() replays an append-only log of snapshot, transaction and block records."""
+
+    test_cache_file, blockchain, block, transaction = append_only_log
+    cached_blockchain = get_current_blockchain(test_cache_file)
+
+    assert cached_blockchain.difficulty == blockchain.difficulty
+    assert len(cached_blockchain.chain) == 2
+    assert cached_blockchain.chain[0].compute_hash() == blockchain.chain[0].compute_hash()
+    assert cached_blockchain.last_block.compute_hash() == block.compute_hash()
+    assert cached_blockchain.last_block.previous_hash == cached_blockchain.chain[0].compute_hash()
+
+    # The incomplete trailing record is ignored
+    assert cached_blockchain.unconfirmed_transactions == [transaction]
+
+
+def test_get_current_blockchain_summary_append_only_log(append_only_log):
+    """Tests that get_current_blockchain_summary() agrees with get_current_blockchain() on an append-only log."""
+
+    test_cache_file, _, _, _ = append_only_log
+    cached_blockchain = get_current_blockchain(test_cache_file)
+    blockchain_summary = get_current_blockchain_summary(test_cache_file)
+
+    assert blockchain_summary.chain_length == len(cached_blockchain.chain)
+    assert blockchain_summary.unconfirmed_transactions == cached_blockchain.unconfirmed_transactions
+    assert blockchain_summary.last_block.compute_hash() == cached_blockchain.last_block.compute_hash()
+
+
+def test_get_current_blockchain_summary_no_cache_file(tmp_path):
+    """Tests that get_current_blockchain_summary() summarizes a new blockchain when there is no cache file."""
+
+    blockchain_summary = get_current_blockchain_summary(str(tmp_path / "blockchain.txt"))
+
+    assert blockchain_summary.chain_length == 1
+    assert blockchain_summary.unconfirmed_transactions == []
+    assert blockchain_summary.last_block.compute_hash() == Blockchain().last_block.compute_hash()
+
+
+def test_get_cached_blockchain_memoized_parse(tmp_path):
+    """Tests that get_current_blockchain() hands out independent copies and notices when the file is written to."""
+
+    transaction = {"sender_id": "A", "receiver_id": "B", "timestamp": 0.0, "amount": 0.0}
+    test_cache_file = tmp_path / "blockchain.txt"
+    test_cache_file.write_text(json.dumps(Blockchain().__dict__()) + "\n")
+
+    first_blockchain = get_current_blockchain(str(test_cache_file))
+    first_blockchain.add_new_transaction("A", "B", 0.0, 0.0)
+    second_blockchain = get_current_blockchain(str(test_cache_file))
+
+    assert second_blockchain is not first_blockchain
+    assert second_blockchain.unconfirmed_transactions == []
+
+    with open(test_cache_file, "a") as file:
+        file.write(json.dumps({"transaction": transaction}) + "\n")
+
+    assert get_current_blockchain(str(test_cache_file)).unconfirmed_transactions == [transaction]
+
+
+def test_get_cached_blockchain_copies_blocks(append_only_log):
+    """Tests that changing a block returned by get_current_blockchain() doesn't change what the next call returns."""
+
+    test_cache_file, _, block, transaction = append_only_log
+
+    first_blockchain = get_current_blockchain(test_cache_file)
+    first_blockchain.last_block.nonce = block.nonce + 1
+    first_blockchain.last_block.transactions.append(transaction)
+    first_blockchain.unconfirmed_transactions[0]["amount"] = 1.0
+    second_blockchain = get_current_blockchain(test_cache_file)
+
+    assert second_blockchain.last_block.nonce == block.nonce
+    assert second_blockchain.last_block.transactions == [transaction]
+    assert second_blockchain.last_block.compute_hash() == block.compute_hash()
+    assert second_blockchain.unconfirmed_transactions == [transaction]
+
+
+def test_get_cached_blockchain_block_confirms_oldest_transactions(tmp_path):
+    """Tests that a block record only confirms as many of the oldest unconfirmed transactions as it holds."""
+
+    transactions = [{"sender_id": "A", "receiver_id": "B", "timestamp": 0.0, "amount": amount} for amount in range(3)]
+    blockchain = Blockchain()
+    blockchain.unconfirmed_transactions = transactions[:1]
+    block = Block(1, transactions[:2], blockchain.last_block.compute_hash(), 0.0, 0)
+    blockchain.proof_of_work(block)
+
+    records = [
+        blockchain.__dict__(),
+        {"transaction": transactions[1]},
+        {"transaction": transactions[2]},
+        {"block": block.__dict__},
+    ]
+
+    test_cache_file = tmp_path / "blockchain.txt"
+    test_cache_file.write_text("".join(json.dumps(record) + "\n" for record in records))
+
+    assert get_current_blockchain(str(test_cache_file)).unconfirmed_transactions == transactions[2:]
+    assert get_current_blockchain_summary(str(test_cache_file)).unconfirmed_transactions == transactions[2:]
@@ -1,98 +1,133 @@
-import time
-
 import pytest
 
-from src.utilities import check_data_is_valid_transaction
-
-
-@pytest.mark.parametrize(
-    "data",
-    [
-        {"sender_id": "", "receiver_id": "", "timestamp": 0.0, "amount": 0.0},
-        {
-            "sender_id": "Andrew",
-            "receiver_id": "Andrew2.0",
-            "timestamp": time.time(),
-            "amount": 999.99,
-        },
-        {
-            "sender_id": "Andrew2.0",
-            "receiver_id": "",
-            "timestamp": time.time(),
-            "amount": 0.0,
-        },
-    ],
-)
-def test_check_data_is_valid_transaction_with_valid_data(data):
-    """Tests check_data_is_valid_transaction() returns True with valid data."""
-
-    assert check_data_is_valid_transaction(data)
-
-
-@pytest.mark.parametrize(
-    "data",
-    [
-        None,
-        [],
-        {"sender_id": "Andrew", "receiver_id": "Andrew2.0", "timestamp": time.time()},
-        {
-            "sender_id": "Andrew",
-            "receiver_id": "Andrew2.0",
-            "timestamp": time.time(),
-            "amount": 999.99,
-            "extra": "",
-        },
-        {
-            "sender": "Andrew",
-            "receiver_id": "Andrew2.0",
-            "timestamp": time.time(),
-            "amount": 999.99,
-        },
-        {
-            "sender_id": "Andrew",
-            "receiver": "Andrew2.0",
-            "timestamp": time.time(),
-            "amount": 999.99,
-        },
-        {
-            "sender_id": "Andrew",
-            "receiver_id": "Andrew2.0",
-            "time": time.time(),
-            "amount": 999.99,
-        },
-        {
-            "sender_id": "Andrew",
-            "receiver": "Andrew2.0",
-            "timestamp": time.time(),
-            "quantity": 999.99,
-        },
-        {
-            "sender_id": 100,
-            "receiver_id": "Andrew2.0",
-            "timestamp": time.time(),
-            "amount": 999.99,
-        },
-        {
-            "sender_id": "Andrew",
-            "receiver_id": 100,
-            "timestamp": time.time(),
-            "amount": 999.99,
-        },
-        {
-            "sender_id": "Andrew",
-            "receiver_id": "Andrew2.0",
-            "timestamp": "10:00PM",
-            "amount": 999.99,
-        },
-        {
-            "sender_id": "Andrew",
-            "receiver_id": "Andrew2.0",
-            "timestamp": time.time(),
-            "amount": "999.99",
-        },
-    ],
+from src import utilities
+from src.utilities import BlockchainCacheWriter, check_data_is_valid_transaction
+
+# Short alias for the validator under test
+_validate = check_data_is_valid_transaction
+
+
+@pytest.fixture(autouse=True, scope="session")
+def transaction_schema_is_precomputed():
+    """Checks that the validator's key set and field type table are built once at import, not on every call."""
+
+    assert isinstance(utilities._TRANSACTION_KEYS, frozenset)
+    assert utilities._TRANSACTION_KEYS == {"sender_id", "receiver_id", "timestamp", "amount"}
+    assert isinstance(utilities._TRANSACTION_FIELD_TYPES, tuple)
+    assert {key for key, _ in utilities._TRANSACTION_FIELD_TYPES} == utilities._TRANSACTION_KEYS
+
+
+# Transaction data paired with whether it is valid, each with a short static id
+_TRANSACTION_CASES = (
+    pytest.param({"sender_id": "", "receiver_id": "", "timestamp": 0.0, "amount": 0.0}, True, id="valid-empty-strings"),
+    pytest.param(
+        {"sender_id": "Andrew", "receiver_id": "Andrew2.0", "timestamp": 1.0, "amount": 999.99}, True, id="valid"
+    ),
+    pytest.param(
+        {"sender_id": "Andrew2.0", "receiver_id": "", "timestamp": 1.0, "amount": 0.0}, True, id="valid-empty-receiver"
+    ),
+    pytest.param(None, False, id="invalid-none"),
+    pytest.param([], False, id="invalid-list"),
+    pytest.param(
+        {"sender_id": "Andrew", "receiver_id": "Andrew2.0", "timestamp": 1.0}, False, id="invalid-missing-amount"
+    ),
+    pytest.param(
+        {"sender_id": "Andrew", "receiver_id": "Andrew2.0", "timestamp": 1.0, "amount": 999.99, "extra": ""},
+        False,
+        id="invalid-extra-key",
+    ),
+    pytest.param(
+        {"sender": "Andrew", "receiver_id": "Andrew2.0", "timestamp": 1.0, "amount": 999.99},
+        False,
+        id="invalid-sender-key",
+    ),
+    pytest.param(
+        {"sender_id": "Andrew", "receiver": "Andrew2.0", "timestamp": 1.0, "amount": 999.99},
+        False,
+        id="invalid-receiver-key",
+    ),
+    pytest.param(
+        {"sender_id": "Andrew", "receiver_id": "Andrew2.0", "time": 1.0, "amount": 999.99},
+        False,
+        id="invalid-timestamp-key",
+    ),
+    pytest.param(
+        {"sender_id": "Andrew", "receiver": "Andrew2.0", "timestamp": 1.0, "quantity": 999.99},
+        False,
+        id="invalid-receiver-and-amount-keys",
+    ),
+    pytest.param(
+        {"sender_id": 100, "receiver_id": "Andrew2.0", "timestamp": 1.0, "amount": 999.99},
+        False,
+        id="invalid-sender-type",
+    ),
+    pytest.param(
+        {"sender_id": "Andrew", "receiver_id": 100, "timestamp": 1.0, "amount": 999.99},
+        False,
+        id="invalid-receiver-type",
+    ),
+    pytest.param(
+        {"sender_id": "Andrew", "receiver_id": "Andrew2.0", "timestamp": "10:00PM", "amount": 999.99},
+        False,
+        id="invalid-timestamp-type",
+    ),
+    pytest.param(
+        {"sender_id": "Andrew", "receiver_id": "Andrew2.0", "timestamp": 1.0, "amount": "999.99"},
+        False,
+        id="invalid-amount-type",
+    ),
 )
-def test_check_data_is_valid_transaction_with_invalid_data(data):
-    """Tests check_data_is_valid_transaction() returns False with invalid data."""
 
-    assert not check_data_is_valid_transaction(data)
+
+@pytest.mark.parametrize("data,expected", _TRANSACTION_CASES)
+def test_check_data_is_valid_transaction(data, expected):
+    """Tests check_data_is_valid_transaction() returns True with valid data and False with invalid data."""
+
+    assert _validate(data) is expected
+
+
+def test_check_data_is_valid_transaction_bulk():
+    """Tests check_data_is_valid_transaction() on every case in a single test, without per-case pytest overhead."""
+
+    for case in _TRANSACTION_CASES:
+        data, expected = case.values
+        assert _validate(data) is expected, case.id
+
+
+def test_blockchain_cache_writer_batches_writes(tmp_path):
+    """Tests BlockchainCacheWriter appends every queued write in order and reports them by token once flushed."""
+
+    filepath = str(tmp_path / "blockchain.txt")
+    written = []
+    writer = BlockchainCacheWriter(
+        on_write=lambda path, token, writes, error: written.append((path, token, writes, error)), max_batch_delay=60
+    )
+
+    for line in range(10):
+        writer.enqueue(filepath, b"%d\n" % line, line % 2)
+
+    writer.flush()
+
+    with open(filepath, "rb") as file:
+        assert file.read() == b"".join(b"%d\n" % line for line in range(10))
+
+    # The long delay means nothing is written until the flush, which then writes everything at once
+    assert written == [(filepath, 0, 5, None), (filepath, 1, 5, None)]
+
+
+def test_blockchain_cache_writer_finishes_short_writes(tmp_path, monkeypatch):
+    """Tests BlockchainCacheWriter keeps writing when os.write() only writes part of the data."""
+
+    filepath = str(tmp_path / "blockchain.txt")
+    written = []
+    write = utilities.os.write
+    monkeypatch.setattr(utilities.os, "write", lambda file_descriptor, data: write(file_descriptor, data[:3]))
+    writer = BlockchainCacheWriter(on_write=lambda path, token, writes, error: written.append((writes, error)))
+
+    writer.enqueue(filepath, b'{"transaction": {}}\n')
+    writer.flush()
+
+    with open(filepath, "rb") as file:
+        assert file.read() == b'{"transaction": {}}\n'
+
+    assert written == [(1, None)]